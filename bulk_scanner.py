@@ -1,45 +1,406 @@
-import yfinance as yf
 import pandas as pd
 import numpy as np
 import os
 import time
-import smtplib
-from email.message import EmailMessage
+import glob
+import html
+import json
+import functools
+from datetime import date
+from pathlib import Path
+from dataclasses import dataclass
+from typing import NamedTuple
+import multiprocessing as mp
+# yfinance and smtplib are imported where they're used: yfinance alone drags in curl_cffi,
+# lxml and friends, and the pool's spawned workers only need it once they reach fast_info
+
+CACHE_DIR = "cache"  # Daily parquet snapshots of each ticker's history
+# ADX(14) is a 14-bar mean of DX, which itself needs a 14-bar DI window, so today's and
+# yesterday's ADX are fully determined by the last ~28 bars. 40 leaves headroom.
+SIGNAL_LOOKBACK = 40
+# The screen reads only the last SIGNAL_LOOKBACK bars (the 20-day volume average sits inside
+# them); ~63 trading days leaves ample margin for holidays and missing sessions
+RECENT_PERIOD = "3mo"
+HISTORY_PERIOD = "250d"  # Full history for the backtest, fetched only for screen survivors
+RESULT_COLUMNS = ["ticker", "win_rate", "exp_return", "price", "target", "stop", "rel_vol", "mkt_cap"]
+# Failures expected from a single ticker: network/cache I/O (curl_cffi's request errors subclass
+# OSError), missing quote fields, and malformed history. yfinance's own errors are added by
+# _ticker_errors() so the import stays lazy. Anything else is a bug.
+TICKER_ERRORS = (OSError, KeyError, IndexError, ValueError, TypeError)
+# Display formatting for the email only, so the results frame itself stays numeric and sortable
+REPORT_FORMATS = {
+    "win_rate": lambda v: f"{v:.1f}%",
+    "exp_return": lambda v: f"{v:.2f}%",
+    "price": "{:.2f}".format,
+    "target": "{:.2f}".format,
+    "stop": "{:.2f}".format,
+    "rel_vol": "{:.2f}".format,
+    "mkt_cap": lambda v: f"{v/1e6:.1f}M",
+}
+
+@dataclass(frozen=True)
+class ScanConfig:
+    """Filter and backtest thresholds for one scan. The defaults are the Hybrid strategy."""
+    min_bars: int = 50
+    min_price: float = 1.00
+    min_avg_volume: float = 300_000  # 20-day average, excluding today
+    min_rel_vol: float = 1.5
+    min_adx: float = 20
+    min_mkt_cap: float = 100_000_000
+    hold_days: int = 3  # Backtest exit: the close this many bars after each signal
+    min_win_rate: float = 55  # %
+    min_avg_return: float = 3.0  # %
+    target_mult: float = 1.03
+    stop_mult: float = 0.99
+
+# The array kernels below work along the last axis, so they take one ticker's bars (1-D)
+# or a whole batch stacked as a (tickers, bars) panel (2-D) with the same code.
+
+def _lag(values):
+    """Previous bar's value along the last axis, NaN on the first bar (Series.shift(1))."""
+    out = np.empty_like(values)
+    out[..., 0] = np.nan
+    out[..., 1:] = values[..., :-1]
+    return out
+
+def _rolling_mean(values, window):
+    """Trailing mean over `window` bars. NaN until the window is full, like pandas rolling()."""
+    out = np.full(values.shape, np.nan)
+    if values.shape[-1] < window: return out
+    # Running sums: each window is one subtraction of two prefix sums instead of `window` adds.
+    # Gaps are zeroed for the sum and counted separately so any window touching one stays NaN.
+    missing = ~np.isfinite(values)
+    head = np.zeros(values.shape[:-1] + (1,))
+    sums = np.concatenate((head, np.cumsum(np.where(missing, 0.0, values), axis=-1)), axis=-1)
+    gaps = np.concatenate((head, np.cumsum(missing, axis=-1)), axis=-1)
+    window_sums = sums[..., window:] - sums[..., :-window]
+    out[..., window - 1:] = np.where(gaps[..., window:] > gaps[..., :-window], np.nan, window_sums / window)
+    return out
+
+def _adx_core(high, low, close, period=14):
+    """ADX on raw NumPy arrays. DM/TR/DI/DX stay local; only the ADX series is returned."""
+    prev_close = _lag(close)
+
+    up_move = high - _lag(high)
+    down_move = _lag(low) - low
+    plus_dm = np.where((up_move > down_move) & (up_move > 0), up_move, 0.0)
+    minus_dm = np.where((down_move > up_move) & (down_move > 0), down_move, 0.0)
+    # True Range, folded into one buffer in place. fmax (not maximum) skips the NaN
+    # previous close on the first bar the same way DataFrame.max(axis=1) did
+    tr = high - low
+    np.fmax(tr, np.abs(high - prev_close), out=tr)
+    np.fmax(tr, np.abs(low - prev_close), out=tr)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        atr = _rolling_mean(tr, period)
+        plus_di = 100 * (_rolling_mean(plus_dm, period) / atr)
+        minus_di = 100 * (_rolling_mean(minus_dm, period) / atr)
+        dx = 100 * (np.abs(plus_di - minus_di) / (plus_di + minus_di))
+    return _rolling_mean(dx, period)
+
+class Indicators(NamedTuple):
+    """Per-bar indicator arrays for one ticker, aligned with the rows of its history."""
+    close: np.ndarray
+    adx: np.ndarray
+    sma10: np.ndarray
+    sma20: np.ndarray
 
 def calculate_indicators(df):
-    """Calculates technical indicators (ADX, SMA, etc.) on the dataframe."""
-    df = df.copy()
-    df['UpMove'] = df['High'] - df['High'].shift(1)
-    df['DownMove'] = df['Low'].shift(1) - df['Low']
-    df['+DM'] = np.where((df['UpMove'] > df['DownMove']) & (df['UpMove'] > 0), df['UpMove'], 0)
-    df['-DM'] = np.where((df['DownMove'] > df['UpMove']) & (df['DownMove'] > 0), df['DownMove'], 0)
-    df['TR'] = pd.concat([df['High']-df['Low'], abs(df['High']-df['Close'].shift()), abs(df['Low']-df['Close'].shift())], axis=1).max(axis=1)
-    
-    period = 14
-    df['+DI'] = 100 * (df['+DM'].rolling(period).mean() / df['TR'].rolling(period).mean())
-    df['-DI'] = 100 * (df['-DM'].rolling(period).mean() / df['TR'].rolling(period).mean())
-    df['DX'] = 100 * (abs(df['+DI'] - df['-DI']) / (df['+DI'] + df['-DI']))
-    df['ADX'] = df['DX'].rolling(period).mean()
-    
-    df['SMA10'] = df['Close'].rolling(10).mean()
-    df['SMA20'] = df['Close'].rolling(20).mean()
-    return df
+    """Calculates technical indicators (ADX, SMA, etc.) from the dataframe without modifying it."""
+    close = df['Close'].to_numpy(dtype=float)
+    adx = _adx_core(df['High'].to_numpy(dtype=float), df['Low'].to_numpy(dtype=float), close)
+    return Indicators(close, adx, _rolling_mean(close, 10), _rolling_mean(close, 20))
+
+def _setup_mask(high, low, close, min_adx=20):
+    """Per row of (tickers, bars) panels: is the last bar a live setup?
+    That is Price > SMA10 > SMA20 AND ADX above `min_adx` and rising."""
+    sma10, sma20 = close[:, -10:].mean(axis=1), close[:, -20:].mean(axis=1)
+    mask = (close[:, -1] > sma10) & (sma10 > sma20)
+    # Trend needs only today's SMAs, so run the ADX pipeline just on the rows still trending
+    rows = np.flatnonzero(mask)
+    if rows.size:
+        adx = _adx_core(high[rows], low[rows], close[rows])
+        mask[rows] = (adx[:, -1] > min_adx) & (adx[:, -1] > adx[:, -2])
+    return mask
+
+@functools.lru_cache(maxsize=1)
+def _ticker_errors():
+    """TICKER_ERRORS plus yfinance's exception base, on versions that have one."""
+    try:
+        from yfinance.exceptions import YFException
+    except ImportError:
+        return TICKER_ERRORS
+    return TICKER_ERRORS + (YFException,)
+
+class NoSpyData(Exception):
+    """The SPY download came back empty."""
+
+@functools.lru_cache(maxsize=1)
+def get_spy_snapshot():
+    """SPY's recent daily history, fetched once per process and shared by every benchmark check."""
+    # Same daily disk cache as the ticker list, so a same-day rerun makes no SPY request either
+    spy = cached_download(["SPY"], RECENT_PERIOD).get("SPY")
+    # Raise rather than return an empty frame: lru_cache doesn't keep exceptions, so the next call retries
+    if spy is None or spy.empty: raise NoSpyData("No SPY history returned")
+    return spy
+
+@functools.lru_cache(maxsize=1)
+def _market_tide():
+    """The SPY vs SMA20 verdict, memoized only once it has actually been computed."""
+    closes = get_spy_snapshot()['Close'].to_numpy(dtype=float)
+    # Only today's SMA20 is needed, so average the last 20 closes instead of rolling the whole window
+    spy_sma20 = float(np.mean(closes[-20:]))
+    current_spy = float(closes[-1])
+    if current_spy < spy_sma20:
+        return False, f"Market Tide is LOW (SPY {current_spy:.2f} < {spy_sma20:.2f})"
+    return True, "Market Tide is Healthy"
 
 def get_market_tide():
-    """Checks SPY to determine if the market is safe to trade."""
+    """Checks SPY to determine if the market is safe to trade. Evaluated once per run; failures are retried."""
     try:
-        spy = yf.Ticker("SPY").history(period="50d")
-        if spy.empty: return True, "SPY Data Unavailable"
-        spy_sma20 = spy['Close'].rolling(window=20).mean().iloc[-1]
-        current_spy = spy['Close'].iloc[-1]
-        if current_spy < spy_sma20:
-            return False, f"Market Tide is LOW (SPY {current_spy:.2f} < {spy_sma20:.2f})"
-        return True, "Market Tide is Healthy"
-    except:
+        return _market_tide()
+    except NoSpyData:
+        return True, "SPY Data Unavailable"
+    except Exception:
         return True, "Market Tide Check Failed"
 
-def run_hybrid_scan(ticker_file="tickers.txt"):
+def _cache_path(symbol, ext):
+    """Today's cache file for `symbol`; the date in the name is what expires it."""
+    return os.path.join(CACHE_DIR, f"{symbol}_{date.today():%Y%m%d}.{ext}")
+
+def _write_atomically(path, write):
+    """Runs write(tmp) on a temp file beside `path`, then moves it into place, so an interrupted
+    write never leaves a truncated cache entry behind."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+
+def prune_cache(max_age_days=7):
+    """Deletes cache files that haven't been touched in `max_age_days`."""
+    cutoff = time.time() - max_age_days * 86400
+    for path in glob.glob(os.path.join(CACHE_DIR, "*")):
+        if os.path.getmtime(path) < cutoff:
+            os.remove(path)
+
+def download_with_retry(symbols, attempts=3, **window):
+    """Batched yf.download (window is period= or start=), split into {symbol: history}.
+    Backs off (0.5s, 1s, ...) only when a request actually fails."""
+    import yfinance as yf
+    for attempt in range(attempts):
+        try:
+            # auto_adjust=True fixes split/dividend data issues
+            data = yf.download(symbols, group_by='ticker', threads=True, progress=False, auto_adjust=True, **window)
+        except Exception:
+            if attempt == attempts - 1: raise
+        else:
+            frames = _split_batch(data, symbols)
+            # yfinance reports a throttled request as all-NaN columns rather than an exception, so
+            # a batch with no rows at all is a failure. A few empty symbols in an otherwise full
+            # batch are delisted or mistyped and wouldn't fill in on a retry.
+            if attempt == attempts - 1 or any(not df.empty for df in frames.values()): return frames
+        time.sleep(0.5 * (2 ** attempt))
+
+def _split_batch(data, symbols):
+    """Per-symbol frames out of one batched yf.download result."""
+    # Handle Single Ticker vs Multi-Ticker return structure
+    # Newer yfinance keeps the ticker level even for a one-symbol batch
+    if not isinstance(data.columns, pd.MultiIndex):
+        frames = {symbols[0]: data.dropna()}
+    else:
+        # The wide frame is aligned on the union of dates, so each slice carries
+        # NaN rows for days that symbol didn't trade - drop them before shipping
+        returned = set(data.columns.get_level_values(0))
+        frames = {symbol: data[symbol].dropna() for symbol in symbols if symbol in returned}
+    # float32 keeps ~7 significant digits, plenty for OHLCV, and halves what we cache and
+    # pickle to the pool. The indicator math upcasts so its running sums stay float64.
+    return {symbol: df.astype(np.float32) for symbol, df in frames.items()}
+
+def _cached_histories(period):
+    """{symbol: path of its newest cached history for `period`}, from one listing of CACHE_DIR."""
+    suffix = f".{period}.parquet"
+    newest = {}
+    if not os.path.isdir(CACHE_DIR): return newest
+    # One listing per batch rather than a glob per symbol, which rescans the directory every time.
+    # yyyymmdd names sort chronologically, so the last match for a symbol is its newest.
+    for name in sorted(entry.name for entry in os.scandir(CACHE_DIR)):
+        if name.endswith(suffix):
+            newest[name[:-len(suffix)].rsplit("_", 1)[0]] = os.path.join(CACHE_DIR, name)
+    return newest
+
+def _trim_to_period(df, period):
+    """The bars of `df` a fresh download of `period` ("250d", "3mo", "1y") would cover."""
+    count, unit = int(period.rstrip("dmoy")), period.lstrip("0123456789")
+    # yfinance reads a custom "Nd" period as N calendar days, not N sessions
+    offsets = {"d": pd.DateOffset(days=count), "mo": pd.DateOffset(months=count)}
+    span = offsets.get(unit, pd.DateOffset(years=count))
+    return df[df.index > df.index[-1] - span]
+
+def _read_cached_history(path):
+    """The history cached at `path`, or None (and the file deleted) if it can't be read back."""
+    try:
+        return pd.read_parquet(path)
+    except (OSError, ValueError):  # pyarrow's ArrowInvalid/ArrowIOError subclass these
+        os.remove(path)
+        return None
+
+def cached_download(batch, period=HISTORY_PERIOD):
+    """Returns {symbol: history} for the batch, hitting the network only for symbols not cached today."""
+    frames, stale, missing = {}, {}, []
+    cached = _cached_histories(period)
+    for symbol in batch:
+        previous = cached.get(symbol)
+        old = _read_cached_history(previous) if previous else None
+        if old is None:
+            # Nothing usable on disk (a damaged file counts as never cached), so fetch it afresh
+            cached.pop(symbol, None)
+            missing.append(symbol)
+        elif previous == _cache_path(symbol, f"{period}.parquet"):
+            frames[symbol] = old
+        elif len(old) >= 2:
+            stale[symbol] = old
+        else:
+            missing.append(symbol)
+
+    fetched = {}
+    if stale:
+        # INCREMENTAL TOP-UP: only the bars since the last run. Re-fetch from the second-to-last
+        # cached bar because the last one was saved mid-session (the scan runs before the close).
+        anchor_day = min(old.index[-2] for old in stale.values())
+        delta = download_with_retry(list(stale), start=anchor_day.strftime("%Y-%m-%d"))
+        for symbol, old in stale.items():
+            new = delta.get(symbol)
+            anchor = old.index[-2]
+            # A split or dividend since the last run rescales the whole adjusted history, so
+            # the overlapping bar only matches if the cached part is still valid
+            if (new is None or anchor not in new.index or
+                    not np.isclose(new.at[anchor, 'Close'], old.at[anchor, 'Close'], rtol=1e-4)):
+                missing.append(symbol)
+                continue
+            merged = pd.concat([old[old.index < anchor], new[new.index >= anchor]])
+            # Trim to the period itself rather than the old frame's length, so a short first
+            # fetch (a recent listing) keeps growing until it spans the full period
+            fetched[symbol] = _trim_to_period(merged, period)
+
+    if missing:
+        fetched.update(download_with_retry(missing, period=period))
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    for symbol, df in fetched.items():
+        if df.empty: continue # Don't pin a failed fetch for the rest of the day
+        _write_atomically(_cache_path(symbol, f"{period}.parquet"),
+                          lambda tmp: df.to_parquet(tmp, compression='zstd'))
+        # Today's file supersedes the older one, so the cache holds one file per symbol and period
+        if symbol in cached: os.remove(cached[symbol])
+    frames.update(fetched)
+
+    return frames
+
+def cached_market_cap(symbol):
+    """fast_info market cap, kept on disk for the day next to the symbol's history."""
+    # "mcap.json" rather than "json": entries written while the lookup always returned 0 are never read
+    path = _cache_path(symbol, "mcap.json")
+    if os.path.exists(path):
+        try:
+            with open(path) as f: return float(json.load(f)['market_cap'])
+        except (ValueError, KeyError, TypeError):
+            os.remove(path)  # Damaged entry: drop it and look the cap up again below
+
+    import yfinance as yf
+    mkt_cap = float(yf.Ticker(symbol).fast_info['market_cap'] or 0)
+    if mkt_cap <= 0: return mkt_cap  # A missing cap is worth retrying, not pinning for the day
+    # One file per symbol, so pool workers never contend for the same cache entry
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    def write(tmp):
+        with open(tmp, 'w') as f: json.dump({'market_cap': mkt_cap}, f)
+    _write_atomically(path, write)
+    return mkt_cap
+
+def screen_batch(frames, config=ScanConfig()):
+    """Price, liquidity and today's-setup gates for a whole batch at once. Returns {symbol: (price, rel_vol)} for survivors."""
+    symbols = [symbol for symbol, df in frames.items() if len(df) >= SIGNAL_LOOKBACK]
+    if not symbols: return {}
+
+    # Each ticker's own last SIGNAL_LOOKBACK bars stacked into (tickers, bars) panels, so every
+    # gate below is one vectorised pass over the batch instead of a Python loop per ticker
+    panel = np.stack([frames[symbol][['High', 'Low', 'Close', 'Volume']].to_numpy(dtype=float)[-SIGNAL_LOOKBACK:]
+                      for symbol in symbols])
+    high, low, close, volume = np.moveaxis(panel, -1, 0)
+
+    # --- FILTER 1: PRICE & VOLUME (From History) ---
+    price = close[:, -1]
+    avg_vol_20d = volume[:, -21:-1].mean(axis=1)
+
+    # --- FILTER 2: RELATIVE VOLUME ---
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rel_vol = np.where(avg_vol_20d > 0, volume[:, -1] / avg_vol_20d, 0.0)
+    mask = (price >= config.min_price) & (avg_vol_20d >= config.min_avg_volume) & (rel_vol >= config.min_rel_vol)
+
+    # --- FILTER 3: TODAY'S SETUP (on the last few weeks only) ---
+    rows = np.flatnonzero(mask)
+    mask[rows] = _setup_mask(high[rows], low[rows], close[rows], config.min_adx)
+    return {symbols[i]: (float(price[i]), float(rel_vol[i])) for i in np.flatnonzero(mask)}
+
+def screen_symbol(df, config=ScanConfig()):
+    """screen_batch for a single ticker's history. Returns (price, rel_vol) or None."""
+    return screen_batch({"": df}, config).get("")
+
+def scan_symbol(symbol, df, config=ScanConfig(), screened=None):
+    """Runs the filter stack and backtest on one ticker's history.
+    Returns the result row, or None if a filter rejects it. Errors propagate to the caller.
+    `screened` is screen_batch's (price, rel_vol) for the symbol; without it the screen is rerun here."""
+    # Basic Data Validation (rows are already NaN-free from the batch split)
+    if df.empty or len(df) < config.min_bars: return None
+
+    if screened is None: screened = screen_symbol(df, config)
+    if screened is None: return None
+    price, rel_vol = screened
+
+    # --- FINAL GATE: MARKET CAP CHECK (Only runs on winners) ---
+    # fast_info reads the lightweight quote endpoint instead of scraping the full .info blob
+    try:
+        mkt_cap = cached_market_cap(symbol)
+        if mkt_cap < config.min_mkt_cap: return None
+    except _ticker_errors():
+        mkt_cap = 0 # If info fails, we might still want to see it if chart is good
+
+    # --- BACKTEST ---
+    # Same signal on every past bar, scored by its forward return (all in one vector pass)
+    ind = calculate_indicators(df)
+    sig_mask = ((ind.close > ind.sma10) & (ind.sma10 > ind.sma20) &
+                (ind.adx > config.min_adx) & np.r_[False, np.diff(ind.adx) > 0])
+    # Positions come straight off the bool mask; the last bars have no forward close yet
+    hold = config.hold_days
+    idxs = np.flatnonzero(sig_mask[:-hold])
+    close = ind.close
+    rets = (close[idxs + hold] - close[idxs]) / close[idxs]
+
+    wins = int((rets > 0).sum())
+    total = rets.size
+    total_ret = float(rets.sum())
+    
+    win_rate = (wins/total * 100) if total > 0 else 0
+    avg_ret = (total_ret/total * 100) if total > 0 else 0
+
+    if win_rate < config.min_win_rate or avg_ret < config.min_avg_return: return None
+    # Positional row matching RESULT_COLUMNS. Rates stay numeric; REPORT_FORMATS styles them.
+    return (
+        symbol,
+        win_rate,
+        avg_ret,
+        round(price, 2),
+        round(price * config.target_mult, 2),
+        round(price * config.stop_mult, 2),
+        round(rel_vol, 2),
+        mkt_cap
+    )
+
+def run_hybrid_scan(ticker_file="tickers.txt", config=ScanConfig()):
     all_results = []
+    errors = 0  # Tickers that couldn't be evaluated (as opposed to ones the filters rejected)
     
     # 1. Tide Check
     tide_ok, tide_msg = get_market_tide()
@@ -48,114 +409,87 @@ def run_hybrid_scan(ticker_file="tickers.txt"):
     if not os.path.exists(ticker_file):
         return pd.DataFrame(), f"Error: {ticker_file} not found."
 
-    with open(ticker_file, 'r') as f:
-        all_tickers = [line.strip().upper() for line in f if line.strip()]
+    # split() drops blank lines and stray whitespace in one pass; dict.fromkeys drops repeats
+    # (keeping file order) so no symbol is downloaded or scanned twice
+    all_tickers = list(dict.fromkeys(Path(ticker_file).read_text().upper().split()))
 
     print(f"Loaded {len(all_tickers)} tickers. Starting Hybrid Batch Scan...")
+    prune_cache()
 
     # 2. BATCH SETTINGS
     BATCH_SIZE = 100  # Scans 100 stocks in 1 request
     
-    for i in range(0, len(all_tickers), BATCH_SIZE):
-        batch = all_tickers[i:i+BATCH_SIZE]
-        print(f"Processing Batch {i}-{i+len(batch)} / {len(all_tickers)}...")
-        
-        try:
-            # BULK DOWNLOAD (The speed secret)
-            # auto_adjust=True fixes split/dividend data issues
-            data = yf.download(batch, period="250d", group_by='ticker', threads=True, progress=False, auto_adjust=True)
+    # Per-ticker work is independent, so fan it out across worker processes. Spawn rather than
+    # fork: the tide check has already used yfinance's shared session, and forked workers would
+    # inherit its open connections while the parent keeps downloading on them.
+    scan = functools.partial(scan_symbol, config=config)
+    with mp.get_context("spawn").Pool() as pool:
+        pending = []
+        for i in range(0, len(all_tickers), BATCH_SIZE):
+            batch = all_tickers[i:i+BATCH_SIZE]
+            print(f"Processing Batch {i}-{i+len(batch)} / {len(all_tickers)}...")
             
-            # Iterate through the batch
-            for symbol in batch:
-                try:
-                    # Handle Single Ticker vs Multi-Ticker return structure
-                    if len(batch) == 1:
-                        df = data
-                    else:
-                        df = data[symbol]
-
-                    # Basic Data Validation
-                    if df.empty or len(df) < 50: continue
-                    
-                    # Clean bad data (NaNs)
-                    df = df.dropna(subset=['Close', 'Volume'])
-                    if df.empty: continue
-
-                    # --- FILTER 1: PRICE & VOLUME (From History) ---
-                    price = df['Close'].iloc[-1]
-                    if price < 1.00: continue
-                    
-                    # Volume Check (Using History, not .info)
-                    avg_vol_20d = df['Volume'].iloc[-21:-1].mean()
-                    if avg_vol_20d < 300_000: continue
-
-                    # --- FILTER 2: INDICATORS ---
-                    df = calculate_indicators(df)
-                    today = df.iloc[-1]
-                    yesterday = df.iloc[-2]
-
-                    # Strategy: Price > SMA10 > SMA20 AND Rising ADX
-                    is_trending = (today['Close'] > today['SMA10']) and (today['SMA10'] > today['SMA20'])
-                    is_accelerating = (today['ADX'] > 20) and (today['ADX'] > yesterday['ADX'])
-
-                    if is_trending and is_accelerating:
-                        # --- FILTER 3: RELATIVE VOLUME ---
-                        today_vol = df['Volume'].iloc[-1]
-                        rel_vol = today_vol / avg_vol_20d if avg_vol_20d > 0 else 0
-                        
-                        if rel_vol >= 1.5:
-                            # --- FINAL GATE: .INFO CHECK (Only runs on winners) ---
-                            # This is where we safely call .info without timeouts
-                            try:
-                                t_info = yf.Ticker(symbol).info
-                                mkt_cap = t_info.get('marketCap', 0)
-                                if mkt_cap < 100_000_000: continue
-                            except:
-                                mkt_cap = 0 # If info fails, we might still want to see it if chart is good
-
-                            # --- BACKTEST ---
-                            hist_signals = df[(df['Close'] > df['SMA10']) & 
-                                              (df['SMA10'] > df['SMA20']) & 
-                                              (df['ADX'] > 20) & 
-                                              (df['ADX'] > df['ADX'].shift(1))].index
-                            
-                            wins, total = 0, 0
-                            total_ret = 0
-                            for date in hist_signals:
-                                idx = df.index.get_loc(date)
-                                if idx + 3 < len(df):
-                                    ret = (df.iloc[idx + 3]['Close'] - df.iloc[idx]['Close']) / df.iloc[idx]['Close']
-                                    if ret > 0: wins += 1
-                                    total_ret += ret
-                                    total += 1
-                            
-                            win_rate = (wins/total * 100) if total > 0 else 0
-                            avg_ret = (total_ret/total * 100) if total > 0 else 0
-
-                            if win_rate >= 55 and avg_ret >= 3.0:
-                                all_results.append({
-                                    "ticker": symbol,
-                                    "win_rate": f"{win_rate:.1f}%",
-                                    "exp_return": f"{avg_ret:.2f}%",
-                                    "price": round(price, 2),
-                                    "target": round(price * 1.03, 2),
-                                    "stop": round(price * 0.99, 2),
-                                    "rel_vol": round(rel_vol, 2),
-                                    "mkt_cap": f"{mkt_cap/1e6:.1f}M"
-                                })
-                except Exception as e:
-                    continue # Skip individual bad tickers in batch
-
-            # Sleep slightly between batches to be polite
-            time.sleep(0.5)
-            
-        except Exception as e:
-            print(f"Batch Failed: {e}")
-            continue
+            unscanned = batch  # What a failure below costs
+            try:
+                # Screen on a short recent window first; only the few survivors need the
+                # full history the backtest reads
+                recent = cached_download(batch, RECENT_PERIOD)
+                # Symbols Yahoo returned nothing for (delisted, renamed, typos) are failures, not rejections
+                unscanned = [symbol for symbol in batch if symbol in recent and not recent[symbol].empty]
+                errors += len(batch) - len(unscanned)
+                short = sum(1 for df in recent.values() if 0 < len(df) < SIGNAL_LOOKBACK)
+                if short: print(f"{short} tickers have fewer than {SIGNAL_LOOKBACK} bars to screen")
+                screened = screen_batch(recent, config)
+                unscanned = survivors = [symbol for symbol in batch if symbol in screened]
+                if not survivors: continue
+                frames = cached_download(survivors, HISTORY_PERIOD)
+                unscanned = [symbol for symbol in survivors if symbol in frames and not frames[symbol].empty]
+                errors += len(survivors) - len(unscanned)
 
-    return pd.DataFrame(all_results), tide_msg
+                # Workers chew on this batch while we go back to the network for the next one.
+                # One task per ticker, so an unexpected error only costs that ticker.
+                # The batch screen already passed these, so hand over its numbers instead of re-screening
+                pending.extend((symbol, pool.apply_async(scan, (symbol, frames[symbol]), {'screened': screened[symbol]}))
+                               for symbol in unscanned)
+                
+            except Exception as e:
+                print(f"Batch Failed: {e}")
+                errors += len(unscanned)
+                continue
+
+        for symbol, result in pending:
+            try:
+                row = result.get()
+            except _ticker_errors() as e:
+                print(f"Skipping {symbol}: {e!r}") # Skip individual bad tickers in batch
+                errors += 1
+                continue
+            except Exception as e:
+                # Anything outside TICKER_ERRORS is a real bug in scan_symbol - report it loudly
+                print(f"Scan Failed for {symbol}: {e!r}")
+                errors += 1
+                continue
+            if row is not None: all_results.append(row)
+
+    print(f"Scan complete: {len(all_results)} setups, {errors} tickers failed.")
+
+    # One columnar build at the end; rows are plain tuples so there are no per-row dicts to unpack
+    return pd.DataFrame.from_records(all_results, columns=RESULT_COLUMNS), tide_msg
+
+def render_table(df, formats=REPORT_FORMATS):
+    """HTML table for the report, built straight from the row tuples instead of DataFrame.to_html."""
+    header = "".join(f"<th>{html.escape(col)}</th>" for col in df.columns)
+    cells = [formats.get(col, str) for col in df.columns]
+    rows = "".join(
+        "<tr>" + "".join(f"<td>{html.escape(fmt(v))}</td>" for fmt, v in zip(cells, row)) + "</tr>"
+        for row in df.itertuples(index=False, name=None)
+    )
+    return f'<table border="1"><thead><tr>{header}</tr></thead><tbody>{rows}</tbody></table>'
+
+def build_report(df, status):
+    """Builds the HTML email for one scan's results."""
+    from email.message import EmailMessage
 
-def send_email(df, status):
     msg = EmailMessage()
     repo = os.environ.get('GITHUB_REPOSITORY', 'Scanner')
     
@@ -168,7 +502,7 @@ def send_email(df, status):
         <html><body>
         <h2 style="color:darkgreen">High Conviction Setups</h2>
         <p><b>Status:</b> {status}</p>
-        {df.to_html(index=False)}
+        {render_table(df)}
         <p>Source: {repo}</p>
         </body></html>
         """
@@ -177,10 +511,19 @@ def send_email(df, status):
     msg['Subject'] = subject
     msg['From'] = os.environ.get('EMAIL_USER')
     msg['To'] = os.environ.get('EMAIL_RECEIVER')
+    return msg
+
+def send_reports(messages):
+    """Sends every report over a single SMTP session: one TLS handshake and login for the lot."""
+    import smtplib
 
     with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
         smtp.login(os.environ.get('EMAIL_USER'), os.environ.get('EMAIL_PASS'))
-        smtp.send_message(msg)
+        for msg in messages:
+            smtp.send_message(msg)
+
+def send_email(df, status):
+    send_reports([build_report(df, status)])
 
 if __name__ == "__main__":
     res, status = run_hybrid_scan()